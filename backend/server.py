@@ -1,28 +1,46 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect, BackgroundTasks, Query, Request, Response, status
+from fastapi.routing import APIRoute
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.websockets import WebSocketState
+from anyio import to_thread
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
 import os
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, ConfigDict, Field, EmailStr
+from typing import List, Optional, Dict, Any, Union, Callable, Tuple
+from collections import defaultdict
 import uuid
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-import math
-import json
+from cachetools import TTLCache
+import orjson
+import numpy as np
+import pandas as pd
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
+# Prefer uvloop's libuv-based event loop for socket-heavy work when installed
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection (created in startup_db_client, so each worker process has its own pool)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'ai_blood')]
+client: Optional[AsyncIOMotorClient] = None
+db = None
 
 # JWT Configuration
 SECRET_KEY = os.environ.get("SECRET_KEY", "ai-blood-secret-key-2025-secure")
@@ -32,12 +50,36 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 # Emergent LLM Key
 EMERGENT_LLM_KEY = os.environ.get("EMERGENT_LLM_KEY", "sk-emergent-4D7EcA6B48fC6E7EaC")
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# CORS: explicit comma-separated origins instead of a wildcard
+ALLOWED_ORIGINS = frozenset(
+    origin.strip()
+    for origin in os.environ.get("CORS_ORIGINS", "http://localhost:8081").split(",")
+    if origin.strip()
+)
+
+# Blood request statuses that still need donors
+ACTIVE_REQUEST_STATUSES = ["pending", "matching"]
+
+# Worker threads for blocking work (password hashing)
+THREADPOOL_SIZE = int(os.environ.get("THREADPOOL_SIZE", 200))
+
+# Notifications older than this are removed automatically (TTL index)
+NOTIFICATION_RETENTION_DAYS = 30
+
+# AI recommendations are only generated for these requests
+AI_RECOMMENDATION_URGENCIES = {"emergency", "urgent"}
+AI_RECOMMENDATION_MIN_MATCHES = 3
+
+# Password hashing (bcrypt is CPU-bound, so hashing runs in the worker thread pool)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=10)
 
 # Security
 security = HTTPBearer()
 
+# Authenticated user documents by user id (from the verified token), to skip the users
+# lookup on repeat requests
+user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+
 # Blood type compatibility matrix
 BLOOD_COMPATIBILITY = {
     "O-": ["O-", "O+", "A-", "A+", "B-", "B+", "AB-", "AB+"],
@@ -50,11 +92,40 @@ BLOOD_COMPATIBILITY = {
     "AB+": ["AB+"],
 }
 
+# Reverse lookup: recipient blood type -> compatible donor blood types
+COMPATIBLE_DONORS_FOR = {
+    recipient: [donor for donor, can_donate_to in BLOOD_COMPATIBILITY.items() if recipient in can_donate_to]
+    for recipient in BLOOD_COMPATIBILITY
+}
+
+# Nearby donor search results per requested blood type, by (rounded location, radius);
+# a donor's change only clears the blood types that donor can give to
+nearby_donor_cache: Dict[str, TTLCache] = {
+    blood_type: TTLCache(maxsize=256, ttl=30) for blood_type in BLOOD_COMPATIBILITY
+}
+
 # Create the main app
-app = FastAPI(title="AI Blood - Intelligent Blood Supply Network")
+app = FastAPI(title="AI Blood - Intelligent Blood Supply Network", default_response_class=ORJSONResponse)
+
+class ORJSONRequest(Request):
+    """Request whose JSON body is parsed with orjson"""
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+class ORJSONRoute(APIRoute):
+    """Route that parses request bodies with orjson before Pydantic validation"""
+    def get_route_handler(self) -> Callable:
+        route_handler = super().get_route_handler()
+        
+        async def orjson_route_handler(request: Request) -> Response:
+            return await route_handler(ORJSONRequest(request.scope, request.receive))
+        
+        return orjson_route_handler
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=ORJSONRoute)
 
 # Configure logging
 logging.basicConfig(
@@ -90,7 +161,9 @@ class DonorProfile(BaseModel):
     medical_conditions: Optional[List[str]] = []
 
 class UserResponse(BaseModel):
-    id: str
+    model_config = ConfigDict(populate_by_name=True, extra="ignore")
+    
+    id: str = Field(validation_alias="_id")
     email: str
     full_name: str
     phone: str
@@ -109,13 +182,15 @@ class BloodRequestCreate(BaseModel):
     urgency: str = "normal"  # emergency, urgent, normal
     hospital_name: Optional[str] = None
     hospital_address: Optional[str] = None
-    latitude: Optional[float] = None
-    longitude: Optional[float] = None
+    latitude: Optional[float] = Field(default=None, ge=-90, le=90)
+    longitude: Optional[float] = Field(default=None, ge=-180, le=180)
     patient_name: Optional[str] = None
     notes: Optional[str] = None
 
 class BloodRequestResponse(BaseModel):
-    id: str
+    model_config = ConfigDict(populate_by_name=True, extra="ignore")
+    
+    id: str = Field(validation_alias="_id")
     requester_id: str
     requester_name: str
     blood_type: str
@@ -144,7 +219,9 @@ class DonorMatch(BaseModel):
     last_donation_date: Optional[str] = None
 
 class NotificationResponse(BaseModel):
-    id: str
+    model_config = ConfigDict(populate_by_name=True, extra="ignore")
+    
+    id: str = Field(validation_alias="_id")
     user_id: str
     title: str
     message: str
@@ -156,8 +233,8 @@ class NotificationResponse(BaseModel):
 class DonorUpdateProfile(BaseModel):
     blood_type: Optional[str] = None
     is_available: Optional[bool] = None
-    latitude: Optional[float] = None
-    longitude: Optional[float] = None
+    latitude: Optional[float] = Field(default=None, ge=-90, le=90)
+    longitude: Optional[float] = Field(default=None, ge=-180, le=180)
     address: Optional[str] = None
     weight: Optional[float] = None
     date_of_birth: Optional[str] = None
@@ -166,14 +243,26 @@ class DonorUpdateProfile(BaseModel):
 class AcceptDonationRequest(BaseModel):
     request_id: str
 
+def model_projection(model: type) -> dict:
+    """Mongo projection covering exactly the fields a response model reads"""
+    return {field.validation_alias or name: 1 for name, field in model.model_fields.items()}
+
+BLOOD_REQUEST_PROJECTION = model_projection(BloodRequestResponse)
+NOTIFICATION_PROJECTION = model_projection(NotificationResponse)
+
 # ============== HELPER FUNCTIONS ==============
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password; also returns a new hash when the stored one uses outdated settings
+    (e.g. a different bcrypt cost), else None"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+# Verified against for unknown emails so login timing doesn't reveal which accounts exist
+DUMMY_PASSWORD_HASH = get_password_hash("invalid-password-placeholder")
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -181,8 +270,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    token = credentials.credentials
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
@@ -190,91 +279,132 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    user = await db.users.find_one({"id": user_id})
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
+    
+    user = await db.users.find_one({"_id": user_id})
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
+    user_cache[user_id] = user
     return user
 
-def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calculate distance between two points using Haversine formula (in km)"""
-    R = 6371  # Earth's radius in kilometers
-    
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    delta_lat = math.radians(lat2 - lat1)
-    delta_lon = math.radians(lon2 - lon1)
-    
-    a = math.sin(delta_lat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    
-    return R * c
+def invalidate_cached_user(user_id: str):
+    """Drop the cached document for a user whose record has changed"""
+    user_cache.pop(user_id, None)
+
+def invalidate_nearby_donors(*donor_blood_types: Optional[str]):
+    """Drop cached nearby searches whose results could include donors of these blood types"""
+    for donor_type in donor_blood_types:
+        for recipient_type in BLOOD_COMPATIBILITY.get(donor_type, []):
+            nearby_donor_cache[recipient_type].clear()
 
 def get_compatible_blood_types(recipient_type: str) -> List[str]:
     """Get list of compatible donor blood types for a recipient"""
-    compatible = []
-    for donor_type, can_donate_to in BLOOD_COMPATIBILITY.items():
-        if recipient_type in can_donate_to:
-            compatible.append(donor_type)
-    return compatible
+    return COMPATIBLE_DONORS_FOR.get(recipient_type, [])
 
-def calculate_compatibility_score(donor: dict, request: dict, distance: float) -> float:
-    """Calculate a compatibility score (0-100) based on multiple factors"""
-    score = 100.0
+def calculate_compatibility_scores(donors: List[dict], requested_type: str, distances: np.ndarray) -> np.ndarray:
+    """Calculate compatibility scores (0-100) for all donors at once based on multiple factors"""
+    if not donors:
+        return np.empty(0, dtype=np.float64)
+    
+    profiles = [d.get("donor_profile") or {} for d in donors]
+    available = np.fromiter((bool(p.get("is_available", False)) for p in profiles), dtype=bool, count=len(profiles))
+    blood_types = np.array([p.get("blood_type") for p in profiles], dtype=object)
+    
+    # Unparseable or missing dates become NaT -> NaN days, which never trigger a penalty
+    last_donation = pd.to_datetime(
+        pd.Series([p.get("last_donation_date") for p in profiles], dtype=object),
+        format="ISO8601", utc=True, errors="coerce"
+    )
+    days_since = (pd.Timestamp.now(tz="UTC") - last_donation).dt.days.to_numpy(dtype=np.float64, na_value=np.nan)
+    
+    scores = np.full(len(donors), 100.0)
     
     # Distance factor (closer is better, max penalty 40 points)
-    if distance > 50:
-        score -= 40
-    elif distance > 20:
-        score -= 25
-    elif distance > 10:
-        score -= 15
-    elif distance > 5:
-        score -= 5
+    scores -= np.select([distances > 50, distances > 20, distances > 10, distances > 5], [40, 25, 15, 5], 0)
     
     # Availability factor
-    if not donor.get("donor_profile", {}).get("is_available", False):
-        score -= 30
+    scores -= np.where(available, 0, 30)
     
     # Last donation factor (should be at least 56 days ago)
-    last_donation = donor.get("donor_profile", {}).get("last_donation_date")
-    if last_donation:
-        try:
-            last_date = datetime.fromisoformat(last_donation)
-            days_since = (datetime.utcnow() - last_date).days
-            if days_since < 56:
-                score -= 50  # Cannot donate yet
-            elif days_since < 84:
-                score -= 10  # Recently donated
-        except:
-            pass
+    scores -= np.select([days_since < 56, days_since < 84], [50, 10], 0)  # Cannot donate yet / recently donated
     
     # Exact blood type match bonus
-    if donor.get("donor_profile", {}).get("blood_type") == request.get("blood_type"):
-        score += 10
+    scores += np.where(blood_types == requested_type, 10, 0)
     
-    return max(0, min(100, score))
+    return np.clip(scores, 0, 100)
 
-async def create_notification(user_id: str, title: str, message: str, notif_type: str, data: dict = None):
-    """Create a notification for a user"""
-    notification = {
-        "id": str(uuid.uuid4()),
+def rank_matches(scores: np.ndarray, distances: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    """Indices ordered by score (highest first), then distance; only the best k when given"""
+    if k is None or len(scores) <= k:
+        return np.lexsort((distances, -scores))
+    
+    # Partition to find the k-th best score in O(N), keep everyone tied with it
+    # so distance still breaks ties, then fully sort just those candidates
+    kth_score = -np.partition(-scores, k - 1)[k - 1]
+    candidates = np.flatnonzero(scores >= kth_score)
+    order = np.lexsort((distances[candidates], -scores[candidates]))[:k]
+    return candidates[order]
+
+def facet_count(result: List[dict], key: str) -> int:
+    """Read a {"$count": "count"} sub-pipeline result out of a $facet stage"""
+    counts = result[0][key] if result else []
+    return counts[0]["count"] if counts else 0
+
+# Only the fields used for donor matching (keeps password hashes etc. off the wire)
+DONOR_MATCH_PROJECTION = {
+    "full_name": 1,
+    "distance_m": 1,
+    "donor_profile.blood_type": 1,
+    "donor_profile.is_available": 1,
+    "donor_profile.last_donation_date": 1
+}
+
+async def find_donors_near(latitude: float, longitude: float, radius_km: float, query: dict, limit: int) -> List[dict]:
+    """Find donors within radius_km using the 2dsphere index, nearest first.
+    Each returned document carries its distance in meters under `distance_m`."""
+    pipeline = [
+        {
+            "$geoNear": {
+                "near": {"type": "Point", "coordinates": [longitude, latitude]},
+                "key": "donor_profile.location",
+                "distanceField": "distance_m",
+                "maxDistance": radius_km * 1000,
+                "query": {"role": "donor", **query},
+                "spherical": True
+            }
+        },
+        {"$limit": limit},
+        {"$project": DONOR_MATCH_PROJECTION}
+    ]
+    return await db.users.aggregate(pipeline).to_list(limit)
+
+def build_notification(user_id: str, title: str, message: str, notif_type: str, data: dict = None, now: Optional[datetime] = None) -> dict:
+    """Build a notification document for a user"""
+    return {
+        "_id": uuid.uuid4().hex,
         "user_id": user_id,
         "title": title,
         "message": message,
         "type": notif_type,
         "is_read": False,
         "data": data or {},
-        "created_at": datetime.utcnow()
+        "created_at": now or datetime.utcnow()
     }
+
+async def create_notification(user_id: str, title: str, message: str, notif_type: str, data: dict = None, now: Optional[datetime] = None):
+    """Create a notification for a user"""
+    notification = build_notification(user_id, title, message, notif_type, data, now)
     await db.notifications.insert_one(notification)
     return notification
 
-async def get_ai_recommendation(request_data: dict, matched_donors: List[dict]) -> str:
+async def get_ai_recommendation(request_data: dict, matched_donors: List[dict], total_matches: Optional[int] = None) -> str:
     """Get AI-powered recommendation for blood request matching"""
     try:
         chat = LlmChat(
             api_key=EMERGENT_LLM_KEY,
-            session_id=f"blood-match-{request_data.get('id', 'unknown')}",
+            session_id=f"blood-match-{request_data.get('_id', 'unknown')}",
             system_message="""You are an AI assistant for a blood donation matching system. 
             Analyze blood requests and donor matches to provide intelligent recommendations.
             Be concise and helpful. Focus on urgency, compatibility, and logistics."""
@@ -287,7 +417,7 @@ async def get_ai_recommendation(request_data: dict, matched_donors: List[dict])
         - Urgency: {request_data.get('urgency')}
         - Hospital: {request_data.get('hospital_name', 'Not specified')}
         
-        Matched Donors ({len(matched_donors)} found):
+        Matched Donors ({total_matches if total_matches is not None else len(matched_donors)} found):
         """
         
         for i, donor in enumerate(matched_donors[:5], 1):
@@ -308,9 +438,23 @@ async def get_ai_recommendation(request_data: dict, matched_donors: List[dict])
         logger.error(f"AI recommendation error: {e}")
         return "AI recommendation unavailable. Please review matches manually based on distance and compatibility."
 
+async def store_ai_recommendation(request_id: str, request_data: dict, matched_donors: List[dict], total_matches: int):
+    """Generate the AI recommendation for a request, save it and push it to the requester"""
+    ai_rec = await get_ai_recommendation(request_data, matched_donors, total_matches)
+    
+    await db.blood_requests.update_one(
+        {"_id": request_id},
+        {"$set": {"ai_recommendation": ai_rec, "updated_at": datetime.utcnow()}}
+    )
+    
+    await manager.send_personal_message(
+        {"type": "ai_recommendation", "request_id": request_id, "ai_recommendation": ai_rec},
+        request_data["requester_id"]
+    )
+
 # ============== AUTH ROUTES ==============
 
-@api_router.post("/auth/register", response_model=Token)
+@api_router.post("/auth/register", response_model=Token, response_model_exclude_none=True)
 async def register(user: UserCreate):
     # Check if email already exists
     existing = await db.users.find_one({"email": user.email})
@@ -318,72 +462,55 @@ async def register(user: UserCreate):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create user
+    now = datetime.utcnow()
     user_dict = {
-        "id": str(uuid.uuid4()),
+        "_id": uuid.uuid4().hex,
         "email": user.email,
         "full_name": user.full_name,
         "phone": user.phone,
         "role": user.role,
-        "password_hash": get_password_hash(user.password),
+        "password_hash": await run_in_threadpool(get_password_hash, user.password),
         "donor_profile": None,
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow()
+        "created_at": now,
+        "updated_at": now
     }
     
     await db.users.insert_one(user_dict)
     
     # Create access token
-    access_token = create_access_token(data={"sub": user_dict["id"]})
+    access_token = create_access_token(data={"sub": user_dict["_id"]})
     
     return Token(
         access_token=access_token,
-        user=UserResponse(
-            id=user_dict["id"],
-            email=user_dict["email"],
-            full_name=user_dict["full_name"],
-            phone=user_dict["phone"],
-            role=user_dict["role"],
-            donor_profile=user_dict["donor_profile"],
-            created_at=user_dict["created_at"]
-        )
+        user=UserResponse.model_validate(user_dict)
     )
 
-@api_router.post("/auth/login", response_model=Token)
+@api_router.post("/auth/login", response_model=Token, response_model_exclude_none=True)
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+    password_hash = user["password_hash"] if user else DUMMY_PASSWORD_HASH
+    password_ok, new_hash = await run_in_threadpool(verify_password, credentials.password, password_hash)
+    if not user or not password_ok:
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
-    access_token = create_access_token(data={"sub": user["id"]})
+    # Store the rehash so every account verifies at the same cost as DUMMY_PASSWORD_HASH
+    if new_hash:
+        await db.users.update_one({"_id": user["_id"]}, {"$set": {"password_hash": new_hash}})
+    
+    access_token = create_access_token(data={"sub": user["_id"]})
     
     return Token(
         access_token=access_token,
-        user=UserResponse(
-            id=user["id"],
-            email=user["email"],
-            full_name=user["full_name"],
-            phone=user["phone"],
-            role=user["role"],
-            donor_profile=user.get("donor_profile"),
-            created_at=user["created_at"]
-        )
+        user=UserResponse.model_validate(user)
     )
 
-@api_router.get("/auth/me", response_model=UserResponse)
+@api_router.get("/auth/me", response_model=UserResponse, response_model_exclude_none=True)
 async def get_me(current_user: dict = Depends(get_current_user)):
-    return UserResponse(
-        id=current_user["id"],
-        email=current_user["email"],
-        full_name=current_user["full_name"],
-        phone=current_user["phone"],
-        role=current_user["role"],
-        donor_profile=current_user.get("donor_profile"),
-        created_at=current_user["created_at"]
-    )
+    return UserResponse.model_validate(current_user)
 
 # ============== DONOR ROUTES ==============
 
-@api_router.put("/donor/profile", response_model=UserResponse)
+@api_router.put("/donor/profile", response_model=UserResponse, response_model_exclude_none=True)
 async def update_donor_profile(profile: DonorUpdateProfile, current_user: dict = Depends(get_current_user)):
     """Update donor profile with blood type, availability, and location"""
     
@@ -409,90 +536,94 @@ async def update_donor_profile(profile: DonorUpdateProfile, current_user: dict =
     
     merged_profile = {**existing_profile, **update_data}
     
-    await db.users.update_one(
-        {"id": current_user["id"]},
+    # Keep a GeoJSON point in sync for the 2dsphere index
+    if merged_profile.get("latitude") is not None and merged_profile.get("longitude") is not None:
+        merged_profile["location"] = {
+            "type": "Point",
+            "coordinates": [merged_profile["longitude"], merged_profile["latitude"]]
+        }
+    
+    updated_user = await db.users.find_one_and_update(
+        {"_id": current_user["_id"]},
         {
             "$set": {
                 "donor_profile": merged_profile,
                 "role": "donor",
                 "updated_at": datetime.utcnow()
             }
-        }
+        },
+        projection={"password_hash": 0},
+        return_document=ReturnDocument.AFTER
     )
+    invalidate_cached_user(current_user["_id"])
+    invalidate_nearby_donors(existing_profile.get("blood_type"), merged_profile.get("blood_type"))
     
-    updated_user = await db.users.find_one({"id": current_user["id"]})
-    
-    return UserResponse(
-        id=updated_user["id"],
-        email=updated_user["email"],
-        full_name=updated_user["full_name"],
-        phone=updated_user["phone"],
-        role=updated_user["role"],
-        donor_profile=updated_user.get("donor_profile"),
-        created_at=updated_user["created_at"]
-    )
+    return UserResponse.model_validate(updated_user)
 
-@api_router.get("/donors/nearby", response_model=List[DonorMatch])
+@api_router.get("/donors/nearby", response_model=List[DonorMatch], response_model_exclude_none=True)
 async def get_nearby_donors(
     blood_type: str,
-    latitude: float,
-    longitude: float,
-    radius_km: float = 50,
+    latitude: float = Query(ge=-90, le=90),
+    longitude: float = Query(ge=-180, le=180),
+    radius_km: float = Query(default=50, gt=0),
     current_user: dict = Depends(get_current_user)
 ):
     """Find nearby compatible donors within radius"""
     
+    # Searches from (almost) the same spot share results for a few seconds: the cache
+    # key snaps coordinates to ~100m, while the query itself uses the exact position
+    cache = nearby_donor_cache.get(blood_type)
+    cache_key = (round(latitude, 3), round(longitude, 3), radius_km)
+    cached = cache.get(cache_key) if cache is not None else None
+    if cached is not None:
+        return cached
+    
     # Get compatible blood types
     compatible_types = get_compatible_blood_types(blood_type)
     
-    # Find all donors with compatible blood types
-    donors = await db.users.find({
-        "role": "donor",
-        "donor_profile.blood_type": {"$in": compatible_types},
-        "donor_profile.latitude": {"$exists": True},
-        "donor_profile.longitude": {"$exists": True}
-    }).to_list(1000)
+    # Find compatible donors within radius (distance computed by MongoDB)
+    donors = await find_donors_near(
+        latitude, longitude, radius_km,
+        {"donor_profile.blood_type": {"$in": compatible_types}},
+        limit=1000
+    )
+    distances = np.fromiter((d["distance_m"] for d in donors), dtype=np.float64, count=len(donors)) / 1000
+    
+    scores = calculate_compatibility_scores(donors, blood_type, distances)
     
+    # Order by compatibility score (highest first), then distance
     nearby_donors = []
-    for donor in donors:
+    for i in rank_matches(scores, distances).tolist():
+        donor = donors[i]
         profile = donor.get("donor_profile", {})
-        donor_lat = profile.get("latitude")
-        donor_lon = profile.get("longitude")
-        
-        if donor_lat and donor_lon:
-            distance = haversine_distance(latitude, longitude, donor_lat, donor_lon)
-            
-            if distance <= radius_km:
-                score = calculate_compatibility_score(
-                    donor,
-                    {"blood_type": blood_type},
-                    distance
-                )
-                
-                nearby_donors.append(DonorMatch(
-                    donor_id=donor["id"],
-                    donor_name=donor["full_name"],
-                    blood_type=profile.get("blood_type", "Unknown"),
-                    distance_km=round(distance, 2),
-                    compatibility_score=score,
-                    is_available=profile.get("is_available", False),
-                    last_donation_date=profile.get("last_donation_date")
-                ))
-    
-    # Sort by compatibility score (highest first)
-    nearby_donors.sort(key=lambda x: (-x.compatibility_score, x.distance_km))
-    
+        nearby_donors.append(DonorMatch(
+            donor_id=donor["_id"],
+            donor_name=donor["full_name"],
+            blood_type=profile.get("blood_type", "Unknown"),
+            distance_km=round(float(distances[i]), 2),
+            compatibility_score=float(scores[i]),
+            is_available=profile.get("is_available", False),
+            last_donation_date=profile.get("last_donation_date")
+        ))
+    
+    if cache is not None:
+        cache[cache_key] = nearby_donors
     return nearby_donors
 
 # ============== BLOOD REQUEST ROUTES ==============
 
-@api_router.post("/requests", response_model=BloodRequestResponse)
-async def create_blood_request(request: BloodRequestCreate, current_user: dict = Depends(get_current_user)):
+@api_router.post("/requests", response_model=BloodRequestResponse, response_model_exclude_none=True)
+async def create_blood_request(
+    request: BloodRequestCreate,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
     """Create a new blood request"""
     
+    now = datetime.utcnow()
     request_dict = {
-        "id": str(uuid.uuid4()),
-        "requester_id": current_user["id"],
+        "_id": uuid.uuid4().hex,
+        "requester_id": current_user["_id"],
         "requester_name": current_user["full_name"],
         "blood_type": request.blood_type,
         "units_needed": request.units_needed,
@@ -507,8 +638,8 @@ async def create_blood_request(request: BloodRequestCreate, current_user: dict =
         "notes": request.notes,
         "matched_donors": [],
         "ai_recommendation": None,
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow()
+        "created_at": now,
+        "updated_at": now
     }
     
     await db.blood_requests.insert_one(request_dict)
@@ -517,70 +648,78 @@ async def create_blood_request(request: BloodRequestCreate, current_user: dict =
     if request.latitude and request.longitude:
         compatible_types = get_compatible_blood_types(request.blood_type)
         
-        donors = await db.users.find({
-            "role": "donor",
-            "donor_profile.blood_type": {"$in": compatible_types},
-            "donor_profile.is_available": True,
-            "donor_profile.latitude": {"$exists": True}
-        }).to_list(100)
+        donors = await find_donors_near(
+            request.latitude, request.longitude, 100,  # 100km radius
+            {
+                "donor_profile.blood_type": {"$in": compatible_types},
+                "donor_profile.is_available": True
+            },
+            limit=100
+        )
+        distances = np.fromiter((d["distance_m"] for d in donors), dtype=np.float64, count=len(donors)) / 1000
         
-        matched = []
-        for donor in donors:
-            profile = donor.get("donor_profile", {})
-            donor_lat = profile.get("latitude")
-            donor_lon = profile.get("longitude")
-            
-            if donor_lat and donor_lon:
-                distance = haversine_distance(request.latitude, request.longitude, donor_lat, donor_lon)
-                
-                if distance <= 100:  # 100km radius
-                    score = calculate_compatibility_score(donor, request_dict, distance)
-                    
-                    matched.append({
-                        "donor_id": donor["id"],
-                        "donor_name": donor["full_name"],
-                        "blood_type": profile.get("blood_type"),
-                        "distance_km": round(distance, 2),
-                        "compatibility_score": score,
-                        "is_available": profile.get("is_available", False),
-                        "status": "pending"
-                    })
-                    
-                    # Send notification to donor
-                    await create_notification(
-                        user_id=donor["id"],
-                        title="🩸 Blood Donation Request",
-                        message=f"Emergency {request.urgency} request for {request.blood_type} blood at {request.hospital_name or 'nearby hospital'}. You are {distance:.1f}km away.",
-                        notif_type="request",
-                        data={"request_id": request_dict["id"]}
-                    )
+        scores = calculate_compatibility_scores(donors, request.blood_type, distances)
         
-        # Sort by score
-        matched.sort(key=lambda x: (-x["compatibility_score"], x["distance_km"]))
+        # Notify every donor in range
+        notifications = [
+            build_notification(
+                user_id=donor["_id"],
+                title="🩸 Blood Donation Request",
+                message=f"Emergency {request.urgency} request for {request.blood_type} blood at {request.hospital_name or 'nearby hospital'}. You are {distance:.1f}km away.",
+                notif_type="request",
+                data={"request_id": request_dict["_id"]},
+                now=now
+            )
+            for donor, distance in zip(donors, distances.tolist())
+        ]
+        if notifications:
+            await db.notifications.insert_many(notifications, ordered=False)
+            
+            # Push the request to connected donors after the response is sent
+            background_tasks.add_task(
+                manager.broadcast,
+                make_new_request_frame(request_dict["_id"], request.blood_type),
+                [donor["_id"] for donor in donors]
+            )
         
-        # Get AI recommendation
-        ai_rec = await get_ai_recommendation(request_dict, matched)
+        # Keep only the top 20 by score (highest first), then distance
+        matched = []
+        for i in rank_matches(scores, distances, k=20).tolist():
+            donor = donors[i]
+            profile = donor.get("donor_profile", {})
+            matched.append({
+                "donor_id": donor["_id"],
+                "donor_name": donor["full_name"],
+                "blood_type": profile.get("blood_type"),
+                "distance_km": round(float(distances[i]), 2),
+                "compatibility_score": float(scores[i]),
+                "is_available": profile.get("is_available", False),
+                "status": "pending"
+            })
         
         # Update request with matches
         await db.blood_requests.update_one(
-            {"id": request_dict["id"]},
+            {"_id": request_dict["_id"]},
             {
                 "$set": {
-                    "matched_donors": matched[:20],
-                    "ai_recommendation": ai_rec,
+                    "matched_donors": matched,
                     "status": "matching" if matched else "pending",
-                    "updated_at": datetime.utcnow()
+                    "updated_at": now
                 }
             }
         )
         
-        request_dict["matched_donors"] = matched[:20]
-        request_dict["ai_recommendation"] = ai_rec
+        request_dict["matched_donors"] = matched
         request_dict["status"] = "matching" if matched else "pending"
+        
+        # AI recommendation is filled in after the response is sent, and only
+        # for urgent requests with enough candidates to be worth ranking
+        if request.urgency in AI_RECOMMENDATION_URGENCIES and len(donors) >= AI_RECOMMENDATION_MIN_MATCHES:
+            background_tasks.add_task(store_ai_recommendation, request_dict["_id"], request_dict, matched, len(donors))
     
-    return BloodRequestResponse(**request_dict)
+    return BloodRequestResponse.model_validate(request_dict)
 
-@api_router.get("/requests", response_model=List[BloodRequestResponse])
+@api_router.get("/requests", response_model=List[BloodRequestResponse], response_model_exclude_none=True)
 async def get_blood_requests(
     status: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
@@ -591,28 +730,28 @@ async def get_blood_requests(
     
     # Donors see requests where they are matched
     if current_user["role"] == "donor":
-        query["matched_donors.donor_id"] = current_user["id"]
+        query["matched_donors.donor_id"] = current_user["_id"]
     # Patients/hospitals see their own requests
     elif current_user["role"] in ["patient", "hospital"]:
-        query["requester_id"] = current_user["id"]
+        query["requester_id"] = current_user["_id"]
     # Admins see all
     
     if status:
         query["status"] = status
     
-    requests = await db.blood_requests.find(query).sort("created_at", -1).to_list(100)
+    requests = await db.blood_requests.find(query, BLOOD_REQUEST_PROJECTION).sort("created_at", -1).limit(100).batch_size(100).to_list(100)
     
-    return [BloodRequestResponse(**req) for req in requests]
+    return [BloodRequestResponse.model_validate(req) for req in requests]
 
-@api_router.get("/requests/{request_id}", response_model=BloodRequestResponse)
+@api_router.get("/requests/{request_id}", response_model=BloodRequestResponse, response_model_exclude_none=True)
 async def get_blood_request(request_id: str, current_user: dict = Depends(get_current_user)):
     """Get a specific blood request"""
     
-    request = await db.blood_requests.find_one({"id": request_id})
+    request = await db.blood_requests.find_one({"_id": request_id}, BLOOD_REQUEST_PROJECTION)
     if not request:
         raise HTTPException(status_code=404, detail="Request not found")
     
-    return BloodRequestResponse(**request)
+    return BloodRequestResponse.model_validate(request)
 
 @api_router.post("/requests/{request_id}/accept")
 async def accept_donation_request(request_id: str, current_user: dict = Depends(get_current_user)):
@@ -622,63 +761,64 @@ async def accept_donation_request(request_id: str, current_user: dict = Depends(
     if current_user["role"] != "donor":
         raise HTTPException(status_code=403, detail="Only donors can accept requests")
     
-    # Get the request
-    request = await db.blood_requests.find_one({"id": request_id})
-    if not request:
-        raise HTTPException(status_code=404, detail="Request not found")
-    
-    # Check if donor is in matched list
-    matched = request.get("matched_donors", [])
-    donor_match = None
-    for m in matched:
-        if m.get("donor_id") == current_user["id"]:
-            donor_match = m
-            break
-    
-    if not donor_match:
-        raise HTTPException(status_code=400, detail="You are not matched for this request")
-    
-    # Update donor's status in matched list
-    for m in matched:
-        if m.get("donor_id") == current_user["id"]:
-            m["status"] = "accepted"
-            break
+    now = datetime.utcnow()
     
-    # Update units fulfilled
-    new_fulfilled = request.get("units_fulfilled", 0) + 1
-    new_status = "fulfilled" if new_fulfilled >= request.get("units_needed", 1) else "matching"
-    
-    await db.blood_requests.update_one(
-        {"id": request_id},
+    # Mark this donor as accepted and count the unit in one atomic update; the filter
+    # skips donors who already accepted and closed requests, so retries are no-ops
+    request = await db.blood_requests.find_one_and_update(
         {
-            "$set": {
-                "matched_donors": matched,
-                "units_fulfilled": new_fulfilled,
-                "status": new_status,
-                "updated_at": datetime.utcnow()
-            }
-        }
+            "_id": request_id,
+            "status": {"$nin": ["fulfilled", "cancelled"]},
+            "matched_donors": {"$elemMatch": {"donor_id": current_user["_id"], "status": {"$ne": "accepted"}}}
+        },
+        {
+            "$set": {"matched_donors.$.status": "accepted", "updated_at": now},
+            "$inc": {"units_fulfilled": 1}
+        },
+        projection={"requester_id": 1, "units_fulfilled": 1, "units_needed": 1},
+        return_document=ReturnDocument.AFTER
     )
+    if not request:
+        existing = await db.blood_requests.find_one(
+            {"_id": request_id},
+            {"status": 1, "matched_donors": {"$elemMatch": {"donor_id": current_user["_id"]}}}
+        )
+        if not existing:
+            raise HTTPException(status_code=404, detail="Request not found")
+        if not existing.get("matched_donors"):
+            raise HTTPException(status_code=400, detail="You are not matched for this request")
+        if existing["matched_donors"][0].get("status") == "accepted":
+            raise HTTPException(status_code=400, detail="You have already accepted this request")
+        raise HTTPException(status_code=400, detail="This request is already closed")
+    
+    # Close the request once enough units are pledged (re-checked server-side)
+    if request["units_fulfilled"] >= request.get("units_needed", 1):
+        await db.blood_requests.update_one(
+            {"_id": request_id, "$expr": {"$gte": ["$units_fulfilled", "$units_needed"]}},
+            {"$set": {"status": "fulfilled"}}
+        )
     
     # Update donor's last donation date
     await db.users.update_one(
-        {"id": current_user["id"]},
+        {"_id": current_user["_id"]},
         {
             "$set": {
-                "donor_profile.last_donation_date": datetime.utcnow().isoformat(),
+                "donor_profile.last_donation_date": now.isoformat(),
                 "donor_profile.is_available": False
             }
         }
     )
+    invalidate_cached_user(current_user["_id"])
+    invalidate_nearby_donors((current_user.get("donor_profile") or {}).get("blood_type"))
     
     # Create donation record
     donation = {
-        "id": str(uuid.uuid4()),
-        "donor_id": current_user["id"],
+        "_id": uuid.uuid4().hex,
+        "donor_id": current_user["_id"],
         "request_id": request_id,
         "blood_type": current_user.get("donor_profile", {}).get("blood_type"),
         "status": "scheduled",
-        "created_at": datetime.utcnow()
+        "created_at": now
     }
     await db.donations.insert_one(donation)
     
@@ -688,29 +828,31 @@ async def accept_donation_request(request_id: str, current_user: dict = Depends(
         title="✅ Donor Accepted",
         message=f"{current_user['full_name']} has accepted to donate for your blood request.",
         notif_type="match",
-        data={"request_id": request_id, "donor_id": current_user["id"]}
+        data={"request_id": request_id, "donor_id": current_user["_id"]},
+        now=now
     )
     
-    return {"message": "Donation accepted successfully", "donation_id": donation["id"]}
+    return {"message": "Donation accepted successfully", "donation_id": donation["_id"]}
 
 # ============== NOTIFICATION ROUTES ==============
 
-@api_router.get("/notifications", response_model=List[NotificationResponse])
+@api_router.get("/notifications", response_model=List[NotificationResponse], response_model_exclude_none=True)
 async def get_notifications(current_user: dict = Depends(get_current_user)):
     """Get user's notifications"""
     
     notifications = await db.notifications.find(
-        {"user_id": current_user["id"]}
-    ).sort("created_at", -1).to_list(50)
+        {"user_id": current_user["_id"]},
+        NOTIFICATION_PROJECTION
+    ).sort("created_at", -1).limit(50).batch_size(50).to_list(50)
     
-    return [NotificationResponse(**n) for n in notifications]
+    return [NotificationResponse.model_validate(n) for n in notifications]
 
 @api_router.put("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, current_user: dict = Depends(get_current_user)):
     """Mark a notification as read"""
     
     result = await db.notifications.update_one(
-        {"id": notification_id, "user_id": current_user["id"]},
+        {"_id": notification_id, "user_id": current_user["_id"]},
         {"$set": {"is_read": True}}
     )
     
@@ -724,7 +866,7 @@ async def mark_all_notifications_read(current_user: dict = Depends(get_current_u
     """Mark all notifications as read"""
     
     await db.notifications.update_many(
-        {"user_id": current_user["id"]},
+        {"user_id": current_user["_id"]},
         {"$set": {"is_read": True}}
     )
     
@@ -738,13 +880,23 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
     
     stats = {}
     
+    # Unread count, gathered together with each role's queries below
+    def count_unread():
+        return db.notifications.count_documents({
+            "user_id": current_user["_id"],
+            "is_read": False
+        })
+    
     if current_user["role"] == "donor":
         # Donor stats
-        donations = await db.donations.count_documents({"donor_id": current_user["id"]})
-        pending_requests = await db.blood_requests.count_documents({
-            "matched_donors.donor_id": current_user["id"],
-            "status": {"$in": ["pending", "matching"]}
-        })
+        donations, pending_requests, unread = await asyncio.gather(
+            db.donations.count_documents({"donor_id": current_user["_id"]}),
+            db.blood_requests.count_documents({
+                "matched_donors.donor_id": current_user["_id"],
+                "status": {"$in": ACTIVE_REQUEST_STATUSES}
+            }),
+            count_unread()
+        )
         
         stats = {
             "total_donations": donations,
@@ -755,15 +907,18 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
     
     elif current_user["role"] in ["patient", "hospital"]:
         # Patient/Hospital stats
-        my_requests = await db.blood_requests.count_documents({"requester_id": current_user["id"]})
-        fulfilled = await db.blood_requests.count_documents({
-            "requester_id": current_user["id"],
-            "status": "fulfilled"
-        })
-        pending = await db.blood_requests.count_documents({
-            "requester_id": current_user["id"],
-            "status": {"$in": ["pending", "matching"]}
-        })
+        my_requests, fulfilled, pending, unread = await asyncio.gather(
+            db.blood_requests.count_documents({"requester_id": current_user["_id"]}),
+            db.blood_requests.count_documents({
+                "requester_id": current_user["_id"],
+                "status": "fulfilled"
+            }),
+            db.blood_requests.count_documents({
+                "requester_id": current_user["_id"],
+                "status": {"$in": ACTIVE_REQUEST_STATUSES}
+            }),
+            count_unread()
+        )
         
         stats = {
             "total_requests": my_requests,
@@ -772,14 +927,27 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
         }
     
     elif current_user["role"] == "admin":
-        # Admin stats
-        total_donors = await db.users.count_documents({"role": "donor"})
-        active_donors = await db.users.count_documents({
-            "role": "donor",
-            "donor_profile.is_available": True
-        })
-        total_requests = await db.blood_requests.count_documents({})
-        fulfilled = await db.blood_requests.count_documents({"status": "fulfilled"})
+        # Admin stats: one $facet aggregation per collection
+        donor_counts, request_counts, unread = await asyncio.gather(
+            db.users.aggregate([
+                {"$match": {"role": "donor"}},
+                {"$facet": {
+                    "total": [{"$count": "count"}],
+                    "active": [{"$match": {"donor_profile.is_available": True}}, {"$count": "count"}]
+                }}
+            ]).to_list(1),
+            db.blood_requests.aggregate([
+                {"$facet": {
+                    "total": [{"$count": "count"}],
+                    "fulfilled": [{"$match": {"status": "fulfilled"}}, {"$count": "count"}]
+                }}
+            ]).to_list(1),
+            count_unread()
+        )
+        total_donors = facet_count(donor_counts, "total")
+        active_donors = facet_count(donor_counts, "active")
+        total_requests = facet_count(request_counts, "total")
+        fulfilled = facet_count(request_counts, "fulfilled")
         
         stats = {
             "total_donors": total_donors,
@@ -789,12 +957,11 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
             "fulfillment_rate": round((fulfilled / total_requests * 100) if total_requests > 0 else 0, 1)
         }
     
+    else:
+        unread = await count_unread()
+    
     # Get unread notification count
-    unread_notifs = await db.notifications.count_documents({
-        "user_id": current_user["id"],
-        "is_read": False
-    })
-    stats["unread_notifications"] = unread_notifs
+    stats["unread_notifications"] = unread
     
     return stats
 
@@ -806,46 +973,141 @@ async def root():
 
 @api_router.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
+    return {"status": "healthy", "timestamp": datetime.utcnow()}
 
 # ============== WEBSOCKET ==============
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+    # Connections are split over small dicts keyed by hash(user_id), power of two
+    SHARD_COUNT = 16
+    
+    def __init__(self, send_timeout: float = 2.0):
+        # A user may be connected from several devices/tabs at once
+        self.shards: List[Dict[str, List[WebSocket]]] = [defaultdict(list) for _ in range(self.SHARD_COUNT)]
+        self.send_timeout = send_timeout
+        # Close tasks for dropped sockets, referenced until they finish
+        self._closing: set = set()
+    
+    def _shard_index(self, user_id: str) -> int:
+        return hash(user_id) & (self.SHARD_COUNT - 1)
+    
+    def _shard(self, user_id: str) -> Dict[str, List[WebSocket]]:
+        return self.shards[self._shard_index(user_id)]
     
     async def connect(self, websocket: WebSocket, user_id: str):
         await websocket.accept()
-        self.active_connections[user_id] = websocket
+        self._shard(user_id)[user_id].append(websocket)
         logger.info(f"WebSocket connected: {user_id}")
     
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+    def disconnect(self, websocket: WebSocket, user_id: str):
+        shard = self._shard(user_id)
+        connections = shard.get(user_id)
+        if connections and websocket in connections:
+            connections.remove(websocket)
+            if not connections:
+                del shard[user_id]
             logger.info(f"WebSocket disconnected: {user_id}")
     
-    async def send_personal_message(self, message: dict, user_id: str):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_json(message)
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await asyncio.wait_for(websocket.close(code=code), timeout=self.send_timeout)
+        except Exception:
+            pass  # Already closed or unreachable; nothing left to do
     
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections.values():
-            await connection.send_json(message)
+    async def _send(self, websocket: WebSocket, user_id: str, frame: bytes):
+        """Send to one socket; slow or broken connections are dropped and closed
+        so the client notices and reconnects"""
+        try:
+            await asyncio.wait_for(websocket.send_bytes(frame), timeout=self.send_timeout)
+        except Exception as e:
+            logger.warning(f"Dropping WebSocket for {user_id}: {e!r}")
+            self.disconnect(websocket, user_id)
+            task = asyncio.create_task(self._close(websocket, code=1011))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+    
+    async def _send_to_shard(self, targets: List[tuple], frame: bytes):
+        await asyncio.gather(*(
+            self._send(ws, user_id, frame)
+            for user_id, connections in targets
+            for ws in list(connections)
+        ))
+    
+    async def send_personal_message(self, message: Union[dict, bytes], user_id: str):
+        """Send a message (dict, or an already-encoded JSON frame) to one user"""
+        connections = self._shard(user_id).get(user_id)
+        if connections:
+            frame = message if isinstance(message, bytes) else orjson.dumps(message)
+            await asyncio.gather(*(self._send(ws, user_id, frame) for ws in list(connections)))
+    
+    async def broadcast(self, message: Union[dict, bytes], user_ids: Optional[List[str]] = None):
+        """Send a message to the given users (all connected users by default), concurrently"""
+        frame = message if isinstance(message, bytes) else orjson.dumps(message)
+        if user_ids is None:
+            shard_targets = [list(shard.items()) for shard in self.shards]
+        else:
+            shard_targets = [[] for _ in self.shards]
+            for user_id in user_ids:
+                index = self._shard_index(user_id)
+                connections = self.shards[index].get(user_id)
+                if connections:
+                    shard_targets[index].append((user_id, connections))
+        await asyncio.gather(*(
+            self._send_to_shard(targets, frame)
+            for targets in shard_targets
+            if targets
+        ))
+    
+    async def close_all(self, code: int = 1001):
+        """Close every connection, e.g. when the server is going away"""
+        connections = [ws for shard in self.shards for conns in list(shard.values()) for ws in list(conns)]
+        for shard in self.shards:
+            shard.clear()
+        await asyncio.gather(*(ws.close(code=code) for ws in connections), return_exceptions=True)
 
 manager = ConnectionManager()
 
+# Encoded once; every ping gets the same reply
+PONG_FRAME = orjson.dumps({"type": "pong"})
+
+def make_new_request_frame(request_id: str, blood_type: str) -> bytes:
+    """Encode a new_request message by filling a fixed template.
+    Request ids are uuid hex and blood types come from BLOOD_COMPATIBILITY, so neither
+    needs JSON escaping; anything else falls back to orjson."""
+    if blood_type not in BLOOD_COMPATIBILITY or not request_id.isalnum():
+        return orjson.dumps({"type": "new_request", "request_id": request_id, "blood_type": blood_type})
+    return b'{"type":"new_request","request_id":"' + request_id.encode() + b'","blood_type":"' + blood_type.encode() + b'"}'
+
+# Common encodings of a bare ping (JSON.stringify / json.dumps), as text or binary frames,
+# answered without parsing
+PING_FRAMES = frozenset({'{"type":"ping"}', '{"type": "ping"}', b'{"type":"ping"}', b'{"type": "ping"}'})
+
 @app.websocket("/api/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
     await manager.connect(websocket, user_id)
     try:
         while True:
-            data = await websocket.receive_text()
+            # Read the raw ASGI event so binary frames reach orjson without a decode step
+            event = await websocket.receive()
+            if event["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(event.get("code", 1000))
+            # Closed from our side after a failed push; the client will reconnect
+            if websocket.application_state == WebSocketState.DISCONNECTED:
+                break
+            data = event["bytes"] if event.get("bytes") is not None else event.get("text")
+            
+            if data in PING_FRAMES:
+                await websocket.send_bytes(PONG_FRAME)
+                continue
+            
             # Handle incoming messages if needed
-            message = json.loads(data)
-            if message.get("type") == "ping":
-                await manager.send_personal_message({"type": "pong"}, user_id)
+            message = orjson.loads(data)
+            if isinstance(message, dict) and message.get("type") == "ping":
+                await websocket.send_bytes(PONG_FRAME)
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        pass
+    finally:
+        manager.disconnect(websocket, user_id)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -853,26 +1115,169 @@ app.include_router(api_router)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=sorted(ALLOWED_ORIGINS),
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["Authorization", "Content-Type"],
 )
 
+async def drop_legacy_index(collection, name: str):
+    """Drop an index this app no longer creates; missing indexes are ignored"""
+    try:
+        await collection.drop_index(name)
+        logger.info(f"Dropped legacy index {collection.name}.{name}")
+    except OperationFailure:
+        pass
+
+# Documents written by older versions: Mongo-generated ObjectId _id, uuid stored in `id`
+LEGACY_ID_FILTER = {"_id": {"$type": "objectId"}, "id": {"$type": "string"}}
+
+async def migrate_legacy_ids(collection) -> int:
+    """Re-key legacy documents so that _id is their uuid; references to them already use it.
+    Safe to re-run: each document is inserted under its new _id before the old one is removed."""
+    migrated = 0
+    async for doc in collection.find(LEGACY_ID_FILTER):
+        legacy_id = doc.pop("_id")
+        doc["_id"] = doc.pop("id")
+        try:
+            await collection.insert_one(doc)
+        except DuplicateKeyError as e:
+            # Only an _id clash means an earlier, interrupted run already copied it
+            if "_id" not in (e.details or {}).get("keyPattern", {}):
+                raise
+        await collection.delete_one({"_id": legacy_id})
+        migrated += 1
+    return migrated
+
+async def migrate_legacy_documents():
+    if await db.users.count_documents(LEGACY_ID_FILTER, limit=1):
+        # A migrated user briefly shares its email with the original; the unique
+        # index is rebuilt right after the migration
+        await drop_legacy_index(db.users, "email_1")
+    for collection in (db.users, db.blood_requests, db.notifications, db.donations):
+        migrated = await migrate_legacy_ids(collection)
+        if migrated:
+            logger.info(f"Migrated {migrated} legacy documents in {collection.name}")
+
+@app.on_event("startup")
+async def configure_threadpool():
+    # Shared by bcrypt hashing and sync dependencies; anyio's default of 40 threads
+    # is easily exhausted by concurrent logins
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
 @app.on_event("startup")
 async def startup_db_client():
-    # Create indexes for better performance
+    global client, db
+    # Pool sizes are per worker process: N workers keep up to N x MONGO_MIN_POOL_SIZE
+    # connections open against the server
+    client = AsyncIOMotorClient(
+        mongo_url,
+        maxPoolSize=int(os.environ.get("MONGO_MAX_POOL_SIZE", 20)),  # Per worker process
+        minPoolSize=int(os.environ.get("MONGO_MIN_POOL_SIZE", 10)),  # Keep warm connections ready
+        maxIdleTimeMS=30000,
+        serverSelectionTimeoutMS=5000,
+        retryWrites=True,
+        compressors="zstd,zlib",  # Negotiated with the server; zlib is the fallback
+        zlibCompressionLevel=6
+    )
+    db = client[os.environ.get('DB_NAME', 'ai_blood')]
+    
+    # Re-key documents from older versions before anything looks them up by _id
     try:
-        await db.users.create_index("email", unique=True)
-        await db.users.create_index("id", unique=True)
-        await db.users.create_index([("donor_profile.blood_type", 1)])
-        await db.blood_requests.create_index("id", unique=True)
-        await db.blood_requests.create_index([("status", 1), ("created_at", -1)])
-        await db.notifications.create_index([("user_id", 1), ("created_at", -1)])
-        await db.donations.create_index("donor_id")
+        await migrate_legacy_documents()
+        legacy_ids_migrated = True
+    except Exception as e:
+        logger.error(f"Error migrating legacy documents: {e}")
+        legacy_ids_migrated = False
+    
+    # Create indexes for better performance; built concurrently, and create_index is
+    # a no-op when the index already exists. A failed build is logged without
+    # stopping the others or the maintenance steps below.
+    index_results = await asyncio.gather(
+        db.users.create_index("email", unique=True, background=True),
+        db.users.create_index([("role", 1), ("donor_profile.blood_type", 1)], background=True),
+        # Equality fields first, then the geo key used by $geoNear
+        db.users.create_index([
+            ("donor_profile.blood_type", 1),
+            ("donor_profile.is_available", 1),
+            ("donor_profile.location", "2dsphere")
+        ], background=True),
+        db.blood_requests.create_index([("status", 1), ("created_at", -1)], background=True),
+        db.blood_requests.create_index([("requester_id", 1), ("created_at", -1)], background=True),
+        db.blood_requests.create_index([("matched_donors.donor_id", 1), ("status", 1)], background=True),
+        db.notifications.create_index([("user_id", 1), ("created_at", -1)], background=True),
+        db.notifications.create_index([("user_id", 1), ("is_read", 1)], background=True),
+        # TTL: MongoDB deletes notifications once created_at (a BSON Date) is past retention
+        db.notifications.create_index(
+            "created_at",
+            expireAfterSeconds=NOTIFICATION_RETENTION_DAYS * 24 * 60 * 60,
+            background=True
+        ),
+        db.donations.create_index("donor_id", background=True),
+        return_exceptions=True
+    )
+    index_errors = [result for result in index_results if isinstance(result, Exception)]
+    for error in index_errors:
+        logger.error(f"Error creating index: {error}")
+    if not index_errors:
         logger.info("Database indexes created successfully")
+    
+    try:
+        # Indexes from older versions: blood_type is a prefix of the donor matching index,
+        # and ids live in the mandatory _id index once legacy documents are re-keyed
+        legacy_indexes = [(db.users, "donor_profile.blood_type_1")]
+        if legacy_ids_migrated:
+            legacy_indexes += [(db.users, "id_1"), (db.blood_requests, "id_1"), (db.notifications, "id_1")]
+        await asyncio.gather(*(drop_legacy_index(collection, name) for collection, name in legacy_indexes))
     except Exception as e:
-        logger.error(f"Error creating indexes: {e}")
+        logger.error(f"Error dropping legacy indexes: {e}")
+    
+    try:
+        # Backfill GeoJSON locations for donors saved before geo queries were used
+        result = await db.users.update_many(
+            {
+                # Out-of-range coordinates would fail the 2dsphere index and abort the update
+                "donor_profile.latitude": {"$type": "number", "$gte": -90, "$lte": 90},
+                "donor_profile.longitude": {"$type": "number", "$gte": -180, "$lte": 180},
+                "donor_profile.location": {"$exists": False}
+            },
+            [{
+                "$set": {
+                    "donor_profile.location": {
+                        "type": "Point",
+                        "coordinates": ["$donor_profile.longitude", "$donor_profile.latitude"]
+                    }
+                }
+            }]
+        )
+        if result.modified_count:
+            logger.info(f"Backfilled location for {result.modified_count} donors")
+    except Exception as e:
+        logger.error(f"Error backfilling donor locations: {e}")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    # Close WebSockets first so their handlers don't hit a closed Mongo client
+    try:
+        await asyncio.wait_for(manager.close_all(code=1001), timeout=5)
+    except asyncio.TimeoutError:
+        logger.warning("Timed out closing WebSocket connections")
+    # Startup may have failed before the client was created
+    if client is not None:
+        client.close()
+
+if __name__ == "__main__":
+    import uvicorn
+    
+    # One worker by default: WebSocket connections and the user/donor caches are per
+    # process, so with more workers pushes and cache invalidations only reach the
+    # worker that handled the request
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 8001)),
+        workers=int(os.environ.get("WEB_CONCURRENCY", 1)),
+        loop="auto",  # uvloop when installed, like the policy set at import
+        http="httptools",
+        backlog=2048,
+        timeout_graceful_shutdown=10
+    )
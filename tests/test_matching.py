@@ -0,0 +1,54 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import rank_matches  # noqa: E402
+
+
+def test_rank_matches_orders_by_score_then_distance():
+    scores = np.array([80.0, 95.0, 80.0, 60.0])
+    distances = np.array([12.0, 30.0, 3.0, 1.0])
+    assert rank_matches(scores, distances).tolist() == [1, 2, 0, 3]
+
+
+def test_rank_matches_empty_input():
+    empty = np.empty(0, dtype=np.float64)
+    assert rank_matches(empty, empty).tolist() == []
+    assert rank_matches(empty, empty, k=20).tolist() == []
+
+
+@pytest.mark.parametrize("k", [4, 5, 50])
+def test_rank_matches_k_at_least_n_returns_everything(k):
+    scores = np.array([70.0, 90.0, 70.0, 100.0])
+    distances = np.array([2.0, 8.0, 1.0, 40.0])
+    assert rank_matches(scores, distances, k=k).tolist() == rank_matches(scores, distances).tolist() == [3, 1, 2, 0]
+
+
+def test_rank_matches_ties_at_kth_score_are_broken_by_distance():
+    # Three donors tie for the 2nd best score; only the nearest of them makes the cut
+    scores = np.array([90.0, 80.0, 80.0, 80.0, 70.0])
+    distances = np.array([5.0, 30.0, 10.0, 20.0, 1.0])
+    assert rank_matches(scores, distances, k=2).tolist() == [0, 2]
+    assert rank_matches(scores, distances, k=3).tolist() == [0, 2, 3]
+
+
+def test_rank_matches_ties_on_score_and_distance_keep_input_order():
+    scores = np.array([50.0, 50.0, 50.0, 50.0])
+    distances = np.array([3.0, 3.0, 3.0, 3.0])
+    assert rank_matches(scores, distances, k=2).tolist() == [0, 1]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_rank_matches_top_k_matches_full_sort(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 200))
+    # Coarse values so ties on score (and on score + distance) are common
+    scores = rng.integers(0, 11, n).astype(np.float64) * 10
+    distances = rng.integers(0, 20, n).astype(np.float64)
+    k = int(rng.integers(1, n + 1))
+    expected = np.lexsort((distances, -scores))[:k]
+    assert rank_matches(scores, distances, k=k).tolist() == expected.tolist()
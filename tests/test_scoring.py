@@ -0,0 +1,79 @@
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import calculate_compatibility_scores  # noqa: E402
+
+
+def donor(blood_type="O-", is_available=True, last_donation_date=None):
+    return {
+        "donor_profile": {
+            "blood_type": blood_type,
+            "is_available": is_available,
+            "last_donation_date": last_donation_date,
+        }
+    }
+
+
+def days_ago(days: int) -> str:
+    return (datetime.utcnow() - timedelta(days=days)).isoformat()
+
+
+def test_scores_empty_input():
+    scores = calculate_compatibility_scores([], "A+", np.empty(0, dtype=np.float64))
+    assert scores.shape == (0,)
+
+
+def test_scores_distance_penalty():
+    donors = [donor() for _ in range(5)]
+    distances = np.array([0.0, 6.0, 11.0, 21.0, 51.0])
+    scores = calculate_compatibility_scores(donors, "A+", distances)
+    assert scores.tolist() == [100, 95, 85, 75, 60]
+
+
+def test_scores_availability_and_exact_match():
+    donors = [donor("A+"), donor("O-", is_available=False), donor("A+", is_available=False)]
+    scores = calculate_compatibility_scores(donors, "A+", np.array([6.0, 0.0, 6.0]))
+    # 100 - 5 + 10, 100 - 30, 100 - 5 - 30 + 10
+    assert scores.tolist() == [100, 70, 75]
+
+
+@pytest.mark.parametrize("last_donation_date", [None, "", "not-a-date", "2024-13-45", 12345])
+def test_scores_missing_or_invalid_date_has_no_penalty(last_donation_date):
+    scores = calculate_compatibility_scores([donor(last_donation_date=last_donation_date)], "A+", np.array([0.0]))
+    assert scores.tolist() == [100]
+
+
+def test_scores_missing_profile_counts_as_unavailable():
+    donors = [{}, {"donor_profile": None}]
+    scores = calculate_compatibility_scores(donors, "A+", np.array([0.0, 0.0]))
+    assert scores.tolist() == [70, 70]
+
+
+def test_scores_last_donation_penalty():
+    donors = [
+        donor(last_donation_date=days_ago(10)),
+        donor(last_donation_date=days_ago(60)),
+        donor(last_donation_date=days_ago(100)),
+        donor(last_donation_date=days_ago(60) + "Z"),
+        donor(last_donation_date=(datetime.utcnow() - timedelta(days=10)).strftime("%Y-%m-%d")),
+    ]
+    scores = calculate_compatibility_scores(donors, "A+", np.zeros(len(donors)))
+    assert scores.tolist() == [50, 90, 100, 90, 50]
+
+
+def test_scores_future_date_counts_as_recent_donation():
+    future = (datetime.utcnow() + timedelta(days=30)).isoformat()
+    scores = calculate_compatibility_scores([donor(last_donation_date=future)], "A+", np.array([0.0]))
+    assert scores.tolist() == [50]
+
+
+def test_scores_are_clipped_to_range():
+    donors = [donor(is_available=False, last_donation_date=days_ago(1))]
+    scores = calculate_compatibility_scores(donors, "A+", np.array([80.0]))
+    assert scores.tolist() == [0]
@@ -0,0 +1,167 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import orjson
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import ConnectionManager, make_new_request_frame  # noqa: E402
+
+
+def test_new_request_frame_template():
+    frame = make_new_request_frame("0123456789abcdef0123456789abcdef", "AB-")
+    assert frame == orjson.dumps({
+        "type": "new_request",
+        "request_id": "0123456789abcdef0123456789abcdef",
+        "blood_type": "AB-",
+    })
+
+
+@pytest.mark.parametrize("request_id, blood_type", [
+    ('abc"def', "O+"),
+    ("abc\\def", "O+"),
+    ("abc\ndef", "O+"),
+    ("", "O+"),
+    ("abc123", 'A"+'),
+    ("abc123", "unknown type"),
+])
+def test_new_request_frame_escapes_unusual_values(request_id, blood_type):
+    frame = make_new_request_frame(request_id, blood_type)
+    assert orjson.loads(frame) == {"type": "new_request", "request_id": request_id, "blood_type": blood_type}
+
+
+# ============== ConnectionManager ==============
+
+class FakeWebSocket:
+    """Records frames and closes; send_delay/fail simulate a slow or broken client"""
+
+    def __init__(self, send_delay: float = 0.0, fail: bool = False):
+        self.send_delay = send_delay
+        self.fail = fail
+        self.accepted = False
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self):
+        self.accepted = True
+
+    async def send_bytes(self, data: bytes):
+        if self.fail:
+            raise RuntimeError("connection reset")
+        await asyncio.sleep(self.send_delay)
+        self.sent.append(data)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+def connected_users(manager: ConnectionManager) -> dict:
+    return {user_id: list(conns) for shard in manager.shards for user_id, conns in shard.items()}
+
+
+async def drain_closes(manager: ConnectionManager):
+    await asyncio.gather(*manager._closing)
+
+
+def test_connect_and_disconnect_track_each_socket():
+    async def scenario():
+        manager = ConnectionManager()
+        phone, laptop = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(phone, "alice")
+        await manager.connect(laptop, "alice")
+        assert phone.accepted and laptop.accepted
+        assert connected_users(manager) == {"alice": [phone, laptop]}
+        assert manager.shards[manager._shard_index("alice")]["alice"] == [phone, laptop]
+
+        manager.disconnect(phone, "alice")
+        assert connected_users(manager) == {"alice": [laptop]}
+        manager.disconnect(laptop, "alice")
+        assert connected_users(manager) == {}
+        # Unknown sockets and users are ignored
+        manager.disconnect(laptop, "alice")
+        manager.disconnect(FakeWebSocket(), "bob")
+        assert connected_users(manager) == {}
+
+    asyncio.run(scenario())
+
+
+def test_users_are_spread_over_shards():
+    async def scenario():
+        manager = ConnectionManager()
+        users = [f"user-{i}" for i in range(200)]
+        for user_id in users:
+            await manager.connect(FakeWebSocket(), user_id)
+        assert sorted(connected_users(manager)) == sorted(users)
+        assert sum(1 for shard in manager.shards if shard) > 1
+        for index, shard in enumerate(manager.shards):
+            assert all(manager._shard_index(user_id) == index for user_id in shard)
+
+    asyncio.run(scenario())
+
+
+def test_send_personal_message_reaches_every_socket_of_one_user():
+    async def scenario():
+        manager = ConnectionManager()
+        phone, laptop, other = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await manager.connect(phone, "alice")
+        await manager.connect(laptop, "alice")
+        await manager.connect(other, "bob")
+        await manager.send_personal_message({"type": "match"}, "alice")
+        await manager.send_personal_message({"type": "match"}, "nobody")
+        assert phone.sent == laptop.sent == [b'{"type":"match"}']
+        assert other.sent == []
+
+    asyncio.run(scenario())
+
+
+def test_broadcast_to_selected_or_all_users():
+    async def scenario():
+        manager = ConnectionManager()
+        sockets = {f"user-{i}": FakeWebSocket() for i in range(40)}
+        for user_id, ws in sockets.items():
+            await manager.connect(ws, user_id)
+
+        await manager.broadcast(b"selected", ["user-1", "user-2", "offline"])
+        assert {user_id for user_id, ws in sockets.items() if ws.sent} == {"user-1", "user-2"}
+
+        await manager.broadcast({"type": "system"})
+        assert all(ws.sent[-1] == b'{"type":"system"}' for ws in sockets.values())
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("broken_kwargs", [{"send_delay": 1.0}, {"fail": True}])
+def test_slow_or_broken_socket_is_dropped_and_closed(broken_kwargs):
+    async def scenario():
+        manager = ConnectionManager(send_timeout=0.05)
+        broken, healthy = FakeWebSocket(**broken_kwargs), FakeWebSocket()
+        await manager.connect(broken, "alice")
+        await manager.connect(healthy, "alice")
+
+        await manager.broadcast(b"frame", ["alice"])
+        await drain_closes(manager)
+
+        assert healthy.sent == [b"frame"]
+        assert broken.sent == []
+        assert broken.close_code == 1011
+        assert connected_users(manager) == {"alice": [healthy]}
+        assert not manager._closing
+
+    asyncio.run(scenario())
+
+
+def test_close_all_closes_every_socket_and_empties_shards():
+    async def scenario():
+        manager = ConnectionManager()
+        sockets = [FakeWebSocket() for _ in range(10)]
+        for i, ws in enumerate(sockets):
+            await manager.connect(ws, f"user-{i % 4}")
+
+        await manager.close_all(code=1001)
+
+        assert all(ws.close_code == 1001 for ws in sockets)
+        assert connected_users(manager) == {}
+
+    asyncio.run(scenario())